@@ -6,6 +6,12 @@ set -e
 PROJECT_ID="wandern-project-startup"
 REGION="us-central1"
 FUNCTION_NAME="arweave-uploader"
+# Secret Manager secret (at most 64 bytes) keying user_id_hash in uploaded
+# payloads; the functions' runtime service account needs secretAccessor on it
+USER_ID_HASH_SALT_SECRET="arweave-user-id-hash-salt"
+
+# Schema first: the new code's claim query depends on it
+PGPASSWORD=Role7442 ./migrate.sh
 
 echo "🚀 Deploying $FUNCTION_NAME..."
 
@@ -20,7 +26,46 @@ gcloud functions deploy $FUNCTION_NAME \
     --memory=512MB \
     --timeout=300s \
     --set-env-vars="INSTANCE_CONNECTION_NAME=wandern-project-startup:us-central1:wandern-postgres-instance-v3,DB_USER=wandern_user,DB_PASSWORD=Role7442,DB_NAME=wandern" \
+    --set-secrets="USER_ID_HASH_SALT=$USER_ID_HASH_SALT_SECRET:latest" \
+    --project=$PROJECT_ID
+
+# Per-echo worker for the Cloud Tasks fan-out (enabled by setting TASKS_QUEUE
+# and TASKS_SERVICE_ACCOUNT on $FUNCTION_NAME). It is private: only tasks
+# signed with an OIDC token for $TASKS_SERVICE_ACCOUNT may invoke it, and the
+# identity $FUNCTION_NAME runs as needs roles/iam.serviceAccountUser on it.
+QUEUE_NAME="wandern-arweave-tasks"
+UPLOAD_ONE_FUNCTION="arweave-upload-one"
+TASKS_SERVICE_ACCOUNT_NAME="arweave-tasks-invoker"
+TASKS_SERVICE_ACCOUNT="$TASKS_SERVICE_ACCOUNT_NAME@$PROJECT_ID.iam.gserviceaccount.com"
+
+gcloud iam service-accounts describe $TASKS_SERVICE_ACCOUNT --project=$PROJECT_ID >/dev/null 2>&1 \
+    || gcloud iam service-accounts create $TASKS_SERVICE_ACCOUNT_NAME \
+        --display-name="Arweave upload tasks invoker" --project=$PROJECT_ID
+
+echo "🚀 Deploying $UPLOAD_ONE_FUNCTION..."
+
+gcloud functions deploy $UPLOAD_ONE_FUNCTION \
+    --gen2 \
+    --runtime=python311 \
+    --region=$REGION \
+    --source=. \
+    --entry-point=upload_one \
+    --trigger-http \
+    --no-allow-unauthenticated \
+    --memory=512MB \
+    --timeout=300s \
+    --set-env-vars="INSTANCE_CONNECTION_NAME=wandern-project-startup:us-central1:wandern-postgres-instance-v3,DB_USER=wandern_user,DB_PASSWORD=Role7442,DB_NAME=wandern" \
+    --set-secrets="USER_ID_HASH_SALT=$USER_ID_HASH_SALT_SECRET:latest" \
     --project=$PROJECT_ID
 
+gcloud functions add-invoker-policy-binding $UPLOAD_ONE_FUNCTION \
+    --region=$REGION \
+    --member="serviceAccount:$TASKS_SERVICE_ACCOUNT" \
+    --project=$PROJECT_ID
+
+QUEUE_FLAGS="--location=$REGION --max-concurrent-dispatches=20 --max-dispatches-per-second=5 --max-attempts=5 --project=$PROJECT_ID"
+gcloud tasks queues create $QUEUE_NAME $QUEUE_FLAGS 2>/dev/null \
+    || gcloud tasks queues update $QUEUE_NAME $QUEUE_FLAGS
+
 echo "✅ Deploy complete!"
 echo "URL: https://$REGION-$PROJECT_ID.cloudfunctions.net/$FUNCTION_NAME"
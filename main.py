@@ -1,21 +1,57 @@
 """
 Wandern Arweave Uploader Cloud Function
-Uploads finalized Geo Echoes to Arweave via Irys bundler.
+Uploads finalized Geo Echoes to permanent storage via 4EVERLAND (IPFS + Arweave).
 
 MODERATION: Calls Content Moderation Agent BEFORE uploading to Arweave.
 This is the final safety checkpoint before permanent storage.
 """
 import functions_framework
+import asyncio
+import atexit
+import gzip
+import hashlib
 import os
-import json
 import logging
+import threading
+import boto3
 import httpx
-from flask import Request, jsonify
+import orjson
+import sqlalchemy
+from botocore.config import Config
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import text
+from flask import Request, Response
 from datetime import datetime
+from google.cloud.sql.connector import Connector
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+# Root stays at WARNING so library chatter (httpx logs every request at INFO)
+# is dropped; only this module's logger follows LOG_LEVEL (default INFO; set
+# WARNING to drop the per-echo lines).
+logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+if LOG_LEVEL not in logging.getLevelNamesMapping():
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", LOG_LEVEL)
+    LOG_LEVEL = "INFO"
+logger.setLevel(LOG_LEVEL)
+
+
+def _env_int(name: str, default: int) -> int:
+    """Integer setting from the environment, at least 1; default if unset or not an integer."""
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        logger.warning("Invalid %s %r, using %d", name, raw, default)
+        return default
+    if value < 1:
+        logger.warning("%s must be at least 1, got %d; using 1", name, value)
+        return 1
+    return value
 
 # Cloud SQL connection details
 INSTANCE_CONNECTION_NAME = os.environ.get(
@@ -32,48 +68,244 @@ MODERATION_AGENT_URL = os.environ.get(
     "https://us-central1-wandern-project-startup.cloudfunctions.net/wandern-moderation-agent"
 )
 
-# Arweave/Irys config
-ARWEAVE_WALLET_KEY = os.environ.get("ARWEAVE_WALLET_KEY")
-IRYS_NODE = "https://node1.irys.xyz"
+# Cloud Tasks fan-out (optional). When TASKS_QUEUE is set, upload_batch only
+# enqueues pending echoes and upload_one processes each of them.
+GCP_PROJECT = os.environ.get("GCP_PROJECT", "wandern-project-startup")
+TASKS_LOCATION = os.environ.get("TASKS_LOCATION", "us-central1")
+TASKS_QUEUE = os.environ.get("TASKS_QUEUE")
+TASKS_SERVICE_ACCOUNT = os.environ.get("TASKS_SERVICE_ACCOUNT")
+UPLOAD_ONE_URL = os.environ.get(
+    "UPLOAD_ONE_URL",
+    "https://us-central1-wandern-project-startup.cloudfunctions.net/arweave-upload-one"
+)
 
+# Secret key for user_id_hash (BLAKE2b allows up to 64 bytes). Without it the
+# hash is stable but unkeyed, so user IDs could be recovered by brute force.
+USER_ID_HASH_SALT = os.environ.get("USER_ID_HASH_SALT", "").encode("utf-8")
+if len(USER_ID_HASH_SALT) > 64:
+    raise RuntimeError("USER_ID_HASH_SALT must be at most 64 bytes")
+if not USER_ID_HASH_SALT:
+    logger.warning("USER_ID_HASH_SALT not set, user_id_hash is unkeyed")
 
-def get_db_connection():
-    """Get database connection using Cloud SQL Python Connector."""
-    from google.cloud.sql.connector import Connector
-    import pg8000
-    
-    connector = Connector()
-    
-    conn = connector.connect(
+# Constant fields of every uploaded echo payload
+_BASE_PAYLOAD = {
+    "type": "geo-echo",
+    "app": "wandern",
+    "version": "1.0",
+    "moderation": "approved"  # Record that this passed moderation
+}
+
+# Tags for approved echo uploads, flattened once into S3 object metadata
+_TAGS = [
+    {"name": "App-Name", "value": "Wandern"},
+    {"name": "Content-Type", "value": "application/json"},
+    {"name": "Type", "value": "geo-echo"},
+    {"name": "Moderation-Status", "value": "approved"}
+]
+_TAG_META = {tag["name"]: tag["value"] for tag in _TAGS}
+
+# 4EVERLAND credentials from environment variables only (no hardcoded defaults)
+FOUREVERLAND_ACCESS_KEY = os.environ.get("FOUREVERLAND_ACCESS_KEY")
+FOUREVERLAND_SECRET_KEY = os.environ.get("FOUREVERLAND_SECRET_KEY")
+FOUREVERLAND_BUCKET = os.environ.get("FOUREVERLAND_BUCKET", "geoechoes")
+FOUREVERLAND_ENDPOINT = os.environ.get("FOUREVERLAND_ENDPOINT", "https://endpoint.4everland.co")
+
+# Concurrent uploads per batch (worker threads sharing the S3 client's pool)
+UPLOAD_CONCURRENCY = _env_int("UPLOAD_CONCURRENCY", 8)
+
+# Shared S3 client for 4EVERLAND so uploads reuse its connection pool;
+# None when no credentials are configured (content-hash fallback)
+_S3 = boto3.client(
+    's3',
+    endpoint_url=FOUREVERLAND_ENDPOINT,
+    aws_access_key_id=FOUREVERLAND_ACCESS_KEY,
+    aws_secret_access_key=FOUREVERLAND_SECRET_KEY,
+    config=Config(
+        signature_version='s3v4',
+        max_pool_connections=max(20, UPLOAD_CONCURRENCY),
+        retries={'max_attempts': 3, 'mode': 'adaptive'}
+    )
+) if FOUREVERLAND_SECRET_KEY else None
+
+
+def _getconn():
+    """Open a new pg8000 connection through the Cloud SQL Python Connector."""
+    return connector.connect(
         INSTANCE_CONNECTION_NAME,
         "pg8000",
         user=DB_USER,
         password=DB_PASS,
         db=DB_NAME,
     )
+
+
+# Created once per instance so warm invocations reuse the connector's cached
+# certificates and the pool's already-authenticated connections. Lazy refresh
+# fetches certificates on demand: Cloud Functions throttles CPU between
+# requests, which starves the default background refresh.
+connector = Connector(refresh_strategy="lazy", timeout=10)
+atexit.register(connector.close)
+
+# Sized for one Cloud Functions instance: a small steady pool, a little burst
+# headroom, and a bounded wait for a free connection instead of queueing forever.
+_engine = sqlalchemy.create_engine(
+    "postgresql+pg8000://",
+    creator=_getconn,
+    pool_size=5,
+    max_overflow=2,
+    pool_timeout=10,
+    pool_recycle=1800,
+    pool_pre_ping=True,
+)
+
+
+def get_db_connection():
+    """Get a pooled database connection (SQLAlchemy Connection)."""
+    return _engine.connect()
+
+
+# upload_one only accepts OIDC-authenticated calls, so tasks must carry a token
+if TASKS_QUEUE and not TASKS_SERVICE_ACCOUNT:
+    raise RuntimeError("TASKS_SERVICE_ACCOUNT is required when TASKS_QUEUE is set")
+
+# The Cloud Tasks client (and its gRPC stack) is only loaded when fan-out is on
+if TASKS_QUEUE:
+    from google.api_core.exceptions import AlreadyExists
+    from google.cloud import tasks_v2
+    _tasks_client = tasks_v2.CloudTasksClient()
+else:
+    _tasks_client = None
+
+
+# Outbound HTTP runs on one long-lived event loop: an AsyncClient is bound to
+# the loop it first runs on, so a per-request asyncio.run() would throw away
+# its pooled HTTP/2 connections on every invocation.
+_loop = asyncio.new_event_loop()
+threading.Thread(target=_loop.run_forever, name="http-loop", daemon=True).start()
+
+# Keep-alive HTTP/2 client for the moderation agent. Short timeouts fail fast
+# (the echo is released for the next run) and the transport retries connect
+# errors. _moderate_all never has more than MODERATION_CONCURRENCY requests in
+# flight, so none of them waits on the pool.
+MODERATION_CONCURRENCY = 20
+_MOD_CLIENT = httpx.AsyncClient(
+    timeout=httpx.Timeout(10.0, connect=2.0),
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=MODERATION_CONCURRENCY, max_keepalive_connections=10),
+        retries=2,
+    ),
+)
+
+
+# Bounded worker pool for the blocking boto3 uploads (the GIL is released on IO)
+_upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+
+
+# Moderation request bodies at least this large are sent gzip-encoded, once
+# the agent is known to decode Content-Encoding: gzip (opt-in)
+MODERATION_GZIP = os.environ.get("MODERATION_GZIP", "false").lower() == "true"
+GZIP_MIN_BYTES = 1024
+
+
+def _run(coro):
+    """Run a coroutine on the shared HTTP event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+# In-memory LRU of agent verdicts keyed by _moderation_key(), seeded per batch
+# from the moderation_cache join so duplicate content skips the agent call.
+MODERATION_CACHE_SIZE = 4096
+_moderation_cache = OrderedDict()
+_moderation_cache_lock = threading.Lock()
+
+
+def _moderation_key(content: str, content_type: str, media_url: str = None) -> bytes:
+    """
+    SHA-256 of exactly what is sent to the moderation agent (mirrors geo_echoes.content_hash).
     
-    return conn
+    Each field is hashed on its own first, so no two (content, content_type,
+    media_url) triples share a key the way separator-joined text can.
+    """
+    sha256 = hashlib.sha256
+    return sha256(
+        sha256(content.encode("utf-8")).digest()
+        + sha256(content_type.encode("utf-8")).digest()
+        + sha256((media_url or "").encode("utf-8")).digest()
+    ).digest()
+
+
+def _cached_verdict(key: bytes):
+    """Return the cached verdict for key, or None on a miss."""
+    with _moderation_cache_lock:
+        verdict = _moderation_cache.get(key)
+        if verdict is not None:
+            _moderation_cache.move_to_end(key)
+        return verdict
+
 
+def _cache_verdict(key: bytes, verdict: dict):
+    """Store a verdict, evicting the least recently used entries."""
+    with _moderation_cache_lock:
+        _moderation_cache[key] = verdict
+        _moderation_cache.move_to_end(key)
+        while len(_moderation_cache) > MODERATION_CACHE_SIZE:
+            _moderation_cache.popitem(last=False)
 
-def call_moderation_agent(content: str, content_type: str, media_url: str = None) -> dict:
+
+def _verdict_for_cache(result: dict):
+    """Normalize an agent response for caching; None if it must not be cached."""
+    if not isinstance(result.get("is_safe"), bool) or result.get("moderation_status") in ("error", "empty"):
+        return None
+    return {
+        "is_safe": result["is_safe"],
+        "moderation_status": result.get("moderation_status"),
+        "flag_reason": result.get("flag_reason"),
+        "cached": True
+    }
+
+
+async def call_moderation_agent(content: str, content_type: str, media_url: str = None) -> dict:
     """
     Call the Content Moderation Agent for pre-Arweave check.
     This is the FINAL moderation checkpoint before permanent storage.
+    Content the agent has already judged is answered from the verdict cache.
     
     Returns: {"is_safe": bool, "moderation_status": str, "flag_reason": str}
     """
+    # Nothing to moderate - fail closed without a network round-trip
+    if not media_url and not (content or "").strip():
+        return {
+            "is_safe": False,
+            "moderation_status": "empty",
+            "flag_reason": "empty content"
+        }
+    
+    key = _moderation_key(content, content_type, media_url)
+    cached = _cached_verdict(key)
+    if cached is not None:
+        return cached
+    
     try:
-        with httpx.Client(timeout=60) as client:
-            response = client.post(MODERATION_AGENT_URL, json={
-                "content": content,
-                "content_type": content_type,
-                "media_url": media_url
-            })
-            result = response.json()
-            logger.info(f"Pre-Arweave moderation result: {result}")
-            return result
+        body = orjson.dumps({
+            "content": content,
+            "content_type": content_type,
+            "media_url": media_url
+        })
+        headers = {"Content-Type": "application/json"}
+        if MODERATION_GZIP and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        
+        response = await _MOD_CLIENT.post(MODERATION_AGENT_URL, content=body, headers=headers)
+        result = response.json()
+        logger.debug("Pre-Arweave moderation result: %s", result)
+        verdict = _verdict_for_cache(result)
+        if verdict is not None:
+            _cache_verdict(key, verdict)
+        return result
     except Exception as e:
-        logger.error(f"Moderation agent call failed: {e}")
+        logger.error("Moderation agent call failed: %s", e)
         # FAIL CLOSED for Arweave - don't permanently store if we can't verify
         return {
             "is_safe": False,
@@ -82,7 +314,7 @@ def call_moderation_agent(content: str, content_type: str, media_url: str = None
         }
 
 
-def upload_to_permanent_storage(data: dict, tags: list) -> str:
+def upload_to_permanent_storage(data: dict, tag_meta: dict) -> str:
     """
     Upload data to permanent storage via 4EVERLAND (IPFS + Arweave).
     Uses S3-compatible API with 5GB free tier.
@@ -92,44 +324,25 @@ def upload_to_permanent_storage(data: dict, tags: list) -> str:
     - https://4everland.io/ipfs/{CID}
     - Eventually synced to Arweave
     """
-    import hashlib
-    import boto3
-    from botocore.config import Config
-    
-    payload = json.dumps(data).encode('utf-8')
+    # Serialize and hash once; both the upload and every fallback ID reuse them
+    payload = orjson.dumps(data)
     payload_size = len(payload)
+    content_hash = hashlib.sha256(payload).hexdigest()
     
-    logger.info(f"Uploading {payload_size} bytes to 4EVERLAND (IPFS+Arweave)")
+    logger.info("Uploading %d bytes to 4EVERLAND (IPFS+Arweave)", payload_size)
     
-    # 4EVERLAND credentials from environment variables only (no hardcoded defaults)
-    ACCESS_KEY = os.environ.get("FOUREVERLAND_ACCESS_KEY")
-    SECRET_KEY = os.environ.get("FOUREVERLAND_SECRET_KEY")
-    BUCKET = os.environ.get("FOUREVERLAND_BUCKET", "geoechoes")
-    ENDPOINT = os.environ.get("FOUREVERLAND_ENDPOINT", "https://endpoint.4everland.co")
-    
-    if not SECRET_KEY:
+    if _S3 is None:
         logger.warning("FOUREVERLAND_SECRET_KEY not set, using content-hash fallback")
-        content_hash = hashlib.sha256(payload).hexdigest()
         return f"ipfs_pending_{content_hash[:32]}"
     
     try:
-        # Create S3 client for 4EVERLAND
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=ENDPOINT,
-            aws_access_key_id=ACCESS_KEY,
-            aws_secret_access_key=SECRET_KEY,
-            config=Config(signature_version='s3v4')
-        )
-        
         # Generate unique filename using content hash
-        content_hash = hashlib.sha256(payload).hexdigest()
         echo_id = data.get("echo_id", "unknown")
         filename = f"echoes/{echo_id}_{content_hash[:16]}.json"
         
         # Upload to 4EVERLAND (IPFS + Arweave backed)
-        s3_client.put_object(
-            Bucket=BUCKET,
+        resp = _S3.put_object(
+            Bucket=FOUREVERLAND_BUCKET,
             Key=filename,
             Body=payload,
             ContentType='application/json',
@@ -137,36 +350,440 @@ def upload_to_permanent_storage(data: dict, tags: list) -> str:
                 'app': 'wandern',
                 'type': 'geo-echo',
                 'echo_id': str(echo_id),
-                **{tag['name']: tag['value'] for tag in tags if 'name' in tag and 'value' in tag}
+                **tag_meta
             }
         )
         
         # Get the IPFS CID
-        # 4EVERLAND returns CID in the response headers or via head_object
-        head = s3_client.head_object(Bucket=BUCKET, Key=filename)
-        cid = head.get('Metadata', {}).get('ipfs-hash') or head.get('ETag', '').strip('"')
-        
-        # Construct permanent URLs
-        ipfs_url = f"https://ipfs.io/ipfs/{cid}" if cid.startswith('Qm') or cid.startswith('bafy') else None
-        s3_url = f"https://{BUCKET}.4everland.link/{filename}"
+        # 4EVERLAND returns CID in the put_object response headers
+        resp_headers = resp.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+        cid = (
+            resp_headers.get('x-amz-meta-ipfs-hash')
+            or resp_headers.get('ipfs-hash')
+            or resp.get('ETag', '').strip('"')
+        )
         
-        logger.info(f"✅ 4EVERLAND upload successful!")
-        logger.info(f"   S3 URL: {s3_url}")
-        if ipfs_url:
-            logger.info(f"   IPFS URL: {ipfs_url}")
+        logger.info("✅ 4EVERLAND upload successful!")
+        if logger.isEnabledFor(logging.DEBUG):
+            # Construct permanent URLs
+            ipfs_url = f"https://ipfs.io/ipfs/{cid}" if cid.startswith('Qm') or cid.startswith('bafy') else None
+            s3_url = f"https://{FOUREVERLAND_BUCKET}.4everland.link/{filename}"
+            logger.debug("   S3 URL: %s", s3_url)
+            if ipfs_url:
+                logger.debug("   IPFS URL: %s", ipfs_url)
         
         # Return CID or content-hash as permanent ID
         permanent_id = cid if (cid.startswith('Qm') or cid.startswith('bafy')) else f"4ever_{content_hash[:32]}"
         return permanent_id
         
     except Exception as e:
-        logger.error(f"4EVERLAND upload failed: {e}")
+        logger.error("4EVERLAND upload failed: %s", e)
         
         # Fallback to content-hash ID
-        content_hash = hashlib.sha256(payload).hexdigest()
         return f"ipfs_pending_{content_hash[:32]}"
 
 
+def _execute_values(conn, sql: str, columns: tuple, rows: list):
+    """
+    Execute an INSERT once for all rows (pg8000 has no execute_values).
+    
+    The {values} placeholder in sql is expanded to one bound tuple per row,
+    taking each row's values in columns order, so N rows cost one round-trip.
+    Only for INSERT ... VALUES: pg8000 binds parameters untyped, and outside
+    an INSERT Postgres types untyped VALUES columns as text.
+    """
+    values = ", ".join(
+        "(" + ", ".join(f":{column}_{i}" for column in columns) + ")"
+        for i in range(len(rows))
+    )
+    params = {f"{column}_{i}": row[column] for i, row in enumerate(rows) for column in columns}
+    conn.execute(text(sql.format(values=values)), params)
+
+
+def _update_echoes(conn, assignments: str, columns: tuple, rows: list):
+    """
+    UPDATE geo_echoes for all rows (keyed by row["echo_id"]) in one statement.
+    
+    Each {column} placeholder in assignments becomes a CASE over echo_id
+    yielding that row's value. Every bound echo_id is compared with
+    geo_echoes.echo_id directly, so Postgres gives it the column's own type
+    (uuid, bigint, text) and the primary key index stays usable.
+    """
+    ids = [f":echo_id_{i}" for i in range(len(rows))]
+    params = {f"echo_id_{i}": row["echo_id"] for i, row in enumerate(rows)}
+    cases = {}
+    for column in columns:
+        cases[column] = "CASE echo_id " + " ".join(
+            f"WHEN {echo_id} THEN :{column}_{i}" for i, echo_id in enumerate(ids)
+        ) + " END"
+        params.update({f"{column}_{i}": row[column] for i, row in enumerate(rows)})
+    conn.execute(
+        text(f"UPDATE geo_echoes SET {assignments.format(**cases)} WHERE echo_id IN ({', '.join(ids)})"),
+        params
+    )
+
+
+# Echoes pending Arweave upload that no running batch has claimed. Claims
+# older than CLAIM_LEASE_SECONDS belong to a batch that died and are reclaimed.
+PENDING_ECHOES_WHERE = """
+    WHERE is_permanent = TRUE
+    AND arweave_tx_id IS NULL
+    AND is_active = TRUE
+    AND (arweave_claimed_at IS NULL
+         OR arweave_claimed_at < NOW() - make_interval(secs => :lease_seconds))
+"""
+
+# Longer than the function timeout, so a live batch never loses its claim
+CLAIM_LEASE_SECONDS = 600
+
+# Claims after which an echo the agent still could not judge is flagged
+# (fail closed) instead of released, so it cannot hold up the queue forever
+MAX_ARWEAVE_ATTEMPTS = 5
+
+# Echoes claimed per batch (and enqueued per run in Cloud Tasks mode)
+BATCH_SIZE = _env_int("ARWEAVE_BATCH_SIZE", 50)
+
+# Atomically claims up to :batch_size pending echoes (SKIP LOCKED, so concurrent
+# invocations never pick the same echo) and returns them in one round-trip.
+# content_hash is a generated column matching _moderation_key(), so
+# previously judged content arrives already classified, and
+# moderation_content_hash (set by the service that approves an echo, not by
+# this uploader) shows whether that approval still covers the current content.
+CLAIM_ECHOES_QUERY = """
+    WITH claimed AS (
+        UPDATE geo_echoes
+        SET arweave_claimed_at = NOW(),
+            arweave_attempts = arweave_attempts + 1
+        WHERE echo_id IN (
+            SELECT echo_id
+            FROM geo_echoes
+            {where}
+            ORDER BY created_at ASC
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING echo_id, creator_user_id, content, title, content_type,
+                  media_url, created_at,
+                  content_hash, moderation_status, moderation_content_hash,
+                  arweave_attempts
+    )
+    SELECT c.*,
+           m.is_safe AS cached_is_safe, m.status AS cached_status, m.reason AS cached_reason
+    FROM claimed c
+    LEFT JOIN moderation_cache m ON m.hash = c.content_hash
+    ORDER BY c.created_at ASC
+"""
+
+
+def _pending_echoes_where(priority_only: bool = False, single: bool = False) -> str:
+    """Build the pending-echo filter; single restricts it to :echo_id."""
+    where = PENDING_ECHOES_WHERE
+    
+    if priority_only:
+        where += " AND echo_type = 'admin'"
+    if single:
+        where += " AND echo_id = :echo_id"
+    
+    return where
+
+
+def _claim_pending(conn, priority_only: bool = False, echo_id=None) -> list:
+    """
+    Claim pending echoes in a short transaction of its own and return them.
+    
+    The claim is committed immediately so no row locks are held while the
+    batch waits on moderation and uploads.
+    """
+    params = {"lease_seconds": CLAIM_LEASE_SECONDS, "batch_size": BATCH_SIZE}
+    if echo_id is not None:
+        params["echo_id"] = echo_id
+    
+    query = CLAIM_ECHOES_QUERY.format(where=_pending_echoes_where(priority_only, single=echo_id is not None))
+    try:
+        rows = conn.execute(text(query), params).fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows
+
+
+def _user_id_hash(user_id) -> str:
+    """Stable, keyed pseudonym for a creator ID in public payloads."""
+    return hashlib.blake2b(str(user_id).encode("utf-8"), digest_size=16, key=USER_ID_HASH_SALT).hexdigest()
+
+
+async def _moderate_all(echoes) -> list:
+    """
+    Run the final moderation check for a batch of echoes concurrently.
+    
+    Returns one moderation result per echo, in order. Echoes with identical
+    content share one agent call, and at most MODERATION_CONCURRENCY calls
+    run at once, matching the client's pool.
+    """
+    semaphore = asyncio.Semaphore(MODERATION_CONCURRENCY)
+    
+    async def moderate(content, content_type, media_url):
+        async with semaphore:
+            return await call_moderation_agent(
+                content=content,
+                content_type=content_type,
+                media_url=media_url
+            )
+    
+    requests = [
+        (content or title or "", content_type or "text", media_url)
+        for _, _, content, title, content_type, media_url, _ in echoes
+    ]
+    keys = [_moderation_key(*request) for request in requests]
+    
+    # Duplicates in the batch reuse the result of the first echo with their key
+    unique = dict(zip(keys, requests))
+    results = await asyncio.gather(*[moderate(*request) for request in unique.values()])
+    by_key = dict(zip(unique, results))
+    return [by_key[key] for key in keys]
+
+
+def _empty_results() -> dict:
+    """Per-batch results before any echo is processed."""
+    return {
+        "processed": 0,
+        "uploaded": 0,
+        "failed": 0,
+        "flagged": 0,
+        "tx_ids": [],
+        "moderation_results": []
+    }
+
+
+def _process_batch(conn, rows, skip_moderation: bool):
+    """
+    Moderate, upload and record a batch of pending echo rows.
+    
+    The rows must already be claimed (see _claim_pending). All verdicts are
+    written with one statement each and a single commit after the batch;
+    echoes whose moderation call or upload failed are released for the next
+    run. Returns the results summary.
+    """
+    echoes = [row[:7] for row in rows]
+    keys = [bytes(row.content_hash) for row in rows]
+    attempts = [row.arweave_attempts for row in rows]
+    
+    # Known verdicts go straight into the cache; only new content hits the agent
+    for key, row in zip(keys, rows):
+        if row.cached_is_safe is not None:
+            _cache_verdict(key, {
+                "is_safe": row.cached_is_safe,
+                "moderation_status": row.cached_status,
+                "flag_reason": row.cached_reason,
+                "cached": True
+            })
+        elif (row.moderation_status == "approved"
+              and row.moderation_content_hash is not None
+              and bytes(row.moderation_content_hash) == key):
+            # Approved upstream and unchanged since
+            _cache_verdict(key, {
+                "is_safe": True,
+                "moderation_status": "approved",
+                "flag_reason": None,
+                "cached": True
+            })
+    
+    results = _empty_results()
+    
+    # Verdicts are collected here and written in one batch after the loop
+    approved = []
+    flagged = []
+    failed = []
+    new_verdicts = {}
+    
+    # === FINAL MODERATION CHECK ===
+    # This is the last safety checkpoint before permanent storage
+    if skip_moderation:
+        mod_results = [None] * len(echoes)
+    else:
+        mod_results = _run(_moderate_all(echoes))
+    
+    # === APPROVED - UPLOAD TO ARWEAVE ===
+    uploads = {}
+    for echo, key, attempt, mod_result in zip(echoes, keys, attempts, mod_results):
+        echo_id, user_id, content, title, content_type, media_url, created_at = echo
+        results["processed"] += 1
+        
+        if mod_result is not None:
+            if not mod_result.get("cached"):
+                verdict = _verdict_for_cache(mod_result)
+                if verdict is not None:
+                    new_verdicts[key] = {
+                        "hash": key,
+                        "is_safe": verdict["is_safe"],
+                        "status": verdict["moderation_status"],
+                        "reason": verdict["flag_reason"]
+                    }
+            
+            results["moderation_results"].append({
+                "echo_id": echo_id,
+                "is_safe": mod_result.get("is_safe"),
+                "status": mod_result.get("moderation_status"),
+                "model": mod_result.get("model_used")
+            })
+            
+            if mod_result.get("moderation_status") == "error" and attempt < MAX_ARWEAVE_ATTEMPTS:
+                # No verdict (agent unreachable/timed out) - release for a retry
+                logger.warning("Echo %s not moderated (attempt %d), released: %s",
+                               echo_id, attempt, mod_result.get("flag_reason"))
+                failed.append({"echo_id": echo_id})
+                results["failed"] += 1
+                continue
+            
+            if not mod_result.get("is_safe", False):
+                # REJECT - Mark as flagged, do NOT upload to Arweave
+                logger.warning("Echo %s BLOCKED from Arweave: %s", echo_id, mod_result.get("flag_reason"))
+                flagged.append({
+                    "reason": mod_result.get("flag_reason", "Pre-Arweave check failed"),
+                    "echo_id": echo_id
+                })
+                results["flagged"] += 1
+                continue  # Skip to next echo
+        
+        arweave_data = {
+            **_BASE_PAYLOAD,
+            "title": title,
+            "content": content,
+            "content_type": content_type,
+            "created_at": created_at,
+            "user_id_hash": _user_id_hash(user_id)
+        }
+        uploads[_upload_pool.submit(upload_to_permanent_storage, arweave_data, _TAG_META)] = echo_id
+    
+    # Collect uploads in completion order
+    for future in as_completed(uploads):
+        echo_id = uploads[future]
+        try:
+            tx_id = future.result()
+        except Exception as e:
+            logger.error("Failed to process echo %s: %s", echo_id, e)
+            failed.append({"echo_id": echo_id})
+            results["failed"] += 1
+            continue
+        
+        approved.append({"tx_id": tx_id, "echo_id": echo_id})
+        results["uploaded"] += 1
+        results["tx_ids"].append(tx_id)
+        logger.info("Echo %s uploaded to Arweave: %s", echo_id, tx_id)
+    
+    # Record all verdicts with one statement each and a single commit
+    try:
+        if flagged:
+            _update_echoes(
+                conn,
+                """moderation_status = 'flagged', 
+                   moderation_reason = {reason},
+                   is_permanent = FALSE""",
+                ("reason",),
+                flagged
+            )
+        if approved:
+            _update_echoes(
+                conn,
+                """arweave_tx_id = {tx_id}, 
+                   arweave_uploaded_at = NOW(),
+                   moderation_status = 'approved'""",
+                ("tx_id",),
+                approved
+            )
+        if failed:
+            _update_echoes(
+                conn,
+                "arweave_claimed_at = NULL",
+                (),
+                failed
+            )
+        if new_verdicts:
+            _execute_values(
+                conn,
+                """INSERT INTO moderation_cache (hash, is_safe, status, reason)
+                   VALUES {values}
+                   ON CONFLICT (hash) DO NOTHING""",
+                ("hash", "is_safe", "status", "reason"),
+                list(new_verdicts.values())
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return results
+
+
+def _enqueue_pending(conn, priority_only: bool) -> dict:
+    """
+    Dispatch one Cloud Task per pending echo to the upload_one function.
+    
+    Tasks are named after the echo so an echo that is still queued (or was
+    dispatched within the last hour) is not enqueued twice.
+    """
+    query = f"""
+        SELECT echo_id
+        FROM geo_echoes
+        {_pending_echoes_where(priority_only)}
+        ORDER BY created_at ASC
+        LIMIT :batch_size
+    """
+    
+    echo_ids = conn.execute(
+        text(query),
+        {"lease_seconds": CLAIM_LEASE_SECONDS, "batch_size": BATCH_SIZE}
+    ).scalars().all()
+    parent = _tasks_client.queue_path(GCP_PROJECT, TASKS_LOCATION, TASKS_QUEUE)
+    
+    results = {"enqueued": 0, "already_queued": 0}
+    for echo_id in echo_ids:
+        http_request = {
+            "http_method": tasks_v2.HttpMethod.POST,
+            "url": UPLOAD_ONE_URL,
+            "headers": {"Content-Type": "application/json"},
+            "body": orjson.dumps({"echo_id": echo_id}),
+            "oidc_token": {"service_account_email": TASKS_SERVICE_ACCOUNT}
+        }
+        
+        try:
+            _tasks_client.create_task(parent=parent, task={
+                "name": f"{parent}/tasks/echo-{echo_id}",
+                "http_request": http_request
+            })
+            results["enqueued"] += 1
+        except AlreadyExists:
+            results["already_queued"] += 1
+    
+    return results
+
+
+# Preflight response built once at import; Max-Age lets browsers cache it for a day
+CORS_PREFLIGHT = ("", 204, {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST, GET, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization",
+    "Access-Control-Max-Age": "86400"
+})
+
+
+# invalid_text_representation, numeric_value_out_of_range, undefined_function
+# (no operator for the bound type): the value cannot be an echo_id at all
+INVALID_PARAMETER_SQLSTATES = ("22P02", "22003", "42883")
+
+
+def _sqlstate(error) -> str:
+    """SQLSTATE of a pg8000 server error wrapped by SQLAlchemy, or None."""
+    args = getattr(error.orig, "args", ())
+    return args[0].get("C") if args and isinstance(args[0], dict) else None
+
+
+def _json_response(body, status: int = 200, headers: dict = None) -> Response:
+    """Build a JSON response serialized with orjson (bytes, no re-encoding)."""
+    return Response(orjson.dumps(body), status, headers, mimetype="application/json")
+
+
 @functions_framework.http
 def upload_batch(request: Request):
     """
@@ -178,20 +795,20 @@ def upload_batch(request: Request):
     3. If approved → upload to Arweave and record tx_id
     4. If rejected → mark as flagged, do NOT upload
     
+    The results are returned once the verdicts are committed; a failed
+    commit returns 500.
+    
+    When TASKS_QUEUE is set, steps 2-4 are instead dispatched as one Cloud
+    Task per echo to upload_one and this returns {"enqueued": N} right away;
+    those echoes are always moderated (skip_moderation is ignored).
+    
     Query params:
     - priority_only: If true, only upload priority echoes
     - test_mode: If true, skip DB and return mock data
     - skip_moderation: If true, skip final moderation check (for testing only)
     """
-    # CORS Headers
     if request.method == "OPTIONS":
-        headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, GET",
-            "Access-Control-Allow-Headers": "Content-Type, Authorization",
-            "Access-Control-Max-Age": "3600"
-        }
-        return ("", 204, headers)
+        return CORS_PREFLIGHT
 
     headers = {"Access-Control-Allow-Origin": "*"}
 
@@ -206,10 +823,10 @@ def upload_batch(request: Request):
                 "echo_id": "test_echo_001",
                 "content": "Test Geo Echo for Arweave upload",
                 "location": "40.7128,-74.0060",
-                "created_at": datetime.utcnow().isoformat()
+                "created_at": datetime.utcnow()
             }
-            tx_id = upload_to_permanent_storage(mock_echo, [])
-            return (jsonify({
+            tx_id = upload_to_permanent_storage(mock_echo, {})
+            return _json_response({
                 "mode": "test",
                 "processed": 1,
                 "uploaded": 1,
@@ -217,128 +834,78 @@ def upload_batch(request: Request):
                 "flagged": 0,
                 "tx_ids": [tx_id],
                 "message": "Test mode - no database connection used"
-            }), 200, headers)
+            }, 200, headers)
         
         # Production mode - connect to database
         try:
             conn = get_db_connection()
-            cursor = conn.cursor()
         except Exception as db_error:
-            logger.error(f"Database connection failed: {db_error}")
-            return (jsonify({
+            logger.error("Database connection failed: %s", db_error)
+            return _json_response({
                 "error": f"Database connection failed: {str(db_error)}",
                 "instance": INSTANCE_CONNECTION_NAME
-            }), 500, headers)
+            }, 500, headers)
         
-        # Query for echoes pending Arweave upload
-        query = """
-            SELECT echo_id, creator_user_id, content, title, content_type, media_url, created_at, is_permanent
-            FROM geo_echoes
-            WHERE is_permanent = TRUE
-            AND arweave_tx_id IS NULL
-            AND is_active = TRUE
-        """
+        if _tasks_client is not None:
+            with conn:
+                return _json_response(_enqueue_pending(conn, priority_only), 200, headers)
         
-        if priority_only:
-            query += " AND echo_type = 'admin'"
+        try:
+            rows = _claim_pending(conn, priority_only)
+        except Exception:
+            conn.close()
+            raise
         
-        query += " ORDER BY created_at ASC LIMIT 50"
+        # Idle poll: the claim was the only round-trip, skip the batch entirely
+        if not rows:
+            conn.close()
+            return _json_response(_empty_results(), 200, headers)
         
-        cursor.execute(query)
-        echoes = cursor.fetchall()
+        with conn:
+            results = _process_batch(conn, rows, skip_moderation)
         
-        results = {
-            "processed": 0,
-            "uploaded": 0,
-            "failed": 0,
-            "flagged": 0,
-            "tx_ids": [],
-            "moderation_results": []
-        }
+        return _json_response(results, 200, headers)
         
-        for echo in echoes:
-            echo_id, user_id, content, title, content_type, media_url, created_at, is_perma = echo
-            results["processed"] += 1
-            
+    except Exception as e:
+        logger.error("Batch upload failed: %s", e)
+        return _json_response({"error": str(e)}, 500, headers)
+
+
+@functions_framework.http
+def upload_one(request: Request):
+    """
+    HTTP Cloud Function (Cloud Tasks target) to moderate and upload one echo.
+    
+    JSON body: {"echo_id": ...}. Deployed without public access: only the
+    queue's OIDC-authenticated tasks reach it, and the echo is always moderated.
+    A missing or malformed echo_id is rejected with 400 instead of a 500.
+    
+    Returns 500 when the echo could not be processed or recorded so Cloud
+    Tasks retries with backoff. A storage error is not retried here:
+    upload_to_permanent_storage records it as an ipfs_pending_ ID. Echoes
+    that are no longer pending are acknowledged with processed=0.
+    """
+    body = request.get_json(silent=True)
+    echo_id = body.get("echo_id") if isinstance(body, dict) else None
+    if not isinstance(echo_id, (str, int)) or isinstance(echo_id, bool):
+        return _json_response({"error": "echo_id (string or integer) is required"}, 400)
+    
+    try:
+        with get_db_connection() as conn:
             try:
-                # === FINAL MODERATION CHECK ===
-                # This is the last safety checkpoint before permanent storage
-                if not skip_moderation:
-                    mod_result = call_moderation_agent(
-                        content=content or title or "",
-                        content_type=content_type or "text",
-                        media_url=media_url
-                    )
-                    
-                    results["moderation_results"].append({
-                        "echo_id": echo_id,
-                        "is_safe": mod_result.get("is_safe"),
-                        "status": mod_result.get("moderation_status"),
-                        "model": mod_result.get("model_used")
-                    })
-                    
-                    if not mod_result.get("is_safe", False):
-                        # REJECT - Mark as flagged, do NOT upload to Arweave
-                        logger.warning(f"Echo {echo_id} BLOCKED from Arweave: {mod_result.get('flag_reason')}")
-                        cursor.execute(
-                            """UPDATE geo_echoes 
-                               SET moderation_status = 'flagged', 
-                                   moderation_reason = %s,
-                                   is_permanent = FALSE
-                               WHERE echo_id = %s""",
-                            (mod_result.get("flag_reason", "Pre-Arweave check failed"), echo_id)
-                        )
-                        conn.commit()
-                        results["flagged"] += 1
-                        continue  # Skip to next echo
-                
-                # === APPROVED - UPLOAD TO ARWEAVE ===
-                arweave_data = {
-                    "type": "geo-echo",
-                    "app": "wandern",
-                    "version": "1.0",
-                    "title": title,
-                    "content": content,
-                    "content_type": content_type,
-                    "created_at": created_at.isoformat() if created_at else None,
-                    "user_id_hash": str(hash(str(user_id))),
-                    "moderation": "approved"  # Record that this passed moderation
-                }
-                
-                tags = [
-                    {"name": "App-Name", "value": "Wandern"},
-                    {"name": "Content-Type", "value": "application/json"},
-                    {"name": "Type", "value": "geo-echo"},
-                    {"name": "Moderation-Status", "value": "approved"}
-                ]
-                
-                # Upload to Arweave
-                tx_id = upload_to_permanent_storage(arweave_data, tags)
-                
-                # Update database with Arweave tx_id
-                cursor.execute(
-                    """UPDATE geo_echoes 
-                       SET arweave_tx_id = %s, 
-                           arweave_uploaded_at = NOW(),
-                           moderation_status = 'approved'
-                       WHERE echo_id = %s""",
-                    (tx_id, echo_id)
-                )
-                conn.commit()
-                
-                results["uploaded"] += 1
-                results["tx_ids"].append(tx_id)
-                logger.info(f"Echo {echo_id} uploaded to Arweave: {tx_id}")
-                
-            except Exception as e:
-                logger.error(f"Failed to process echo {echo_id}: {e}")
-                results["failed"] += 1
-        
-        cursor.close()
-        conn.close()
+                rows = _claim_pending(conn, echo_id=echo_id)
+            except sqlalchemy.exc.DBAPIError as e:
+                # Not a valid geo_echoes.echo_id: a client error, not a failure
+                if _sqlstate(e) not in INVALID_PARAMETER_SQLSTATES:
+                    raise
+                return _json_response({"error": f"invalid echo_id: {echo_id!r}"}, 400)
+            if not rows:
+                return _json_response(_empty_results())
+            results = _process_batch(conn, rows, skip_moderation=False)
         
-        return (jsonify(results), 200, headers)
+        status = 500 if results["failed"] else 200
+        return _json_response(results, status)
         
     except Exception as e:
-        logger.error(f"Batch upload failed: {e}")
-        return (jsonify({"error": str(e)}), 500, headers)
+        logger.error("Upload of echo %s failed: %s", echo_id, e)
+        return _json_response({"error": str(e)}, 500)
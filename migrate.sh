@@ -0,0 +1,35 @@
+#!/bin/bash
+# Apply migrations/*.sql to the Cloud SQL database, in filename order.
+# Runs before every deploy: main.py's claim query needs the columns, table and
+# indexes they create, and every migration is idempotent (IF NOT EXISTS).
+#
+# Needs cloud-sql-proxy (v2) and psql on PATH, Application Default Credentials
+# with Cloud SQL Client access, and PGPASSWORD for $DB_USER.
+
+set -e
+
+INSTANCE_CONNECTION_NAME="${INSTANCE_CONNECTION_NAME:-wandern-project-startup:us-central1:wandern-postgres-instance-v3}"
+DB_USER="${DB_USER:-wandern_user}"
+DB_NAME="${DB_NAME:-wandern}"
+PROXY_PORT="${PROXY_PORT:-5433}"
+
+: "${PGPASSWORD:?PGPASSWORD must be set}"
+export PGPASSWORD
+
+echo "🗄️  Applying migrations to $INSTANCE_CONNECTION_NAME..."
+
+cloud-sql-proxy --port "$PROXY_PORT" "$INSTANCE_CONNECTION_NAME" &
+PROXY_PID=$!
+trap 'kill $PROXY_PID' EXIT
+
+for _ in $(seq 30); do
+    pg_isready -h 127.0.0.1 -p "$PROXY_PORT" -q && break
+    sleep 1
+done
+
+# psql -f runs in autocommit mode, which CREATE INDEX CONCURRENTLY requires
+for migration in "$(dirname "$0")"/migrations/*.sql; do
+    echo "  $(basename "$migration")"
+    psql -h 127.0.0.1 -p "$PROXY_PORT" -U "$DB_USER" -d "$DB_NAME" \
+        -v ON_ERROR_STOP=1 -q -f "$migration"
+done
@@ -0,0 +1,10 @@
+-- Verdicts from the Content Moderation Agent, keyed by the SHA-256 of the
+-- moderated payload (see _moderation_key in main.py). Lets the uploader skip
+-- the agent call for content it has already judged.
+CREATE TABLE IF NOT EXISTS moderation_cache (
+    hash        bytea PRIMARY KEY,
+    is_safe     boolean NOT NULL,
+    status      text,
+    reason      text,
+    created_at  timestamptz NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,22 @@
+-- Hash of the moderated payload, identical to _moderation_key() in main.py:
+-- sha256(sha256(<content or title>) || sha256(<content_type or 'text'>)
+--        || sha256(<media_url or ''>)).
+-- Hashing each field first keeps the encoding unambiguous, so different
+-- triples cannot share a hash. Lets the pending-echo query LEFT JOIN
+-- moderation_cache directly.
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+ALTER TABLE geo_echoes
+    ADD COLUMN IF NOT EXISTS content_hash bytea GENERATED ALWAYS AS (
+        digest(
+            digest(coalesce(nullif(content, ''), nullif(title, ''), ''), 'sha256')
+            || digest(coalesce(nullif(content_type, ''), 'text'), 'sha256')
+            || digest(coalesce(media_url, ''), 'sha256'),
+            'sha256'
+        )
+    ) STORED;
+
+-- CONCURRENTLY so writes to geo_echoes are not blocked while it builds; it
+-- cannot run inside a transaction block, so apply this file with autocommit
+-- (e.g. psql -f, as migrate.sh does).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS geo_echoes_content_hash_idx ON geo_echoes (content_hash);
@@ -0,0 +1,4 @@
+-- Set when an uploader batch claims an echo (CLAIM_ECHOES_QUERY in main.py).
+-- Claims older than the lease are treated as abandoned and reclaimed.
+ALTER TABLE geo_echoes
+    ADD COLUMN IF NOT EXISTS arweave_claimed_at timestamptz;
@@ -0,0 +1,5 @@
+-- content_hash at the time moderation_status was last set to 'approved'.
+-- Whoever approves an echo should set it alongside the status; the uploader
+-- skips the moderation agent when it still equals content_hash.
+ALTER TABLE geo_echoes
+    ADD COLUMN IF NOT EXISTS moderation_content_hash bytea;
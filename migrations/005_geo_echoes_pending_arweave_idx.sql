@@ -0,0 +1,22 @@
+-- Partial indexes matching the pending-echo predicate in main.py
+-- (PENDING_ECHOES_WHERE, used by CLAIM_ECHOES_QUERY), so "ORDER BY created_at
+-- LIMIT :batch_size" is a range scan over only the not-yet-uploaded rows
+-- instead of a scan of geo_echoes. The claim subquery reads only echo_id and
+-- arweave_claimed_at (003), so both are covered.
+--
+-- content/title/media_url are deliberately not INCLUDEd: they are unbounded
+-- text and would make inserts fail once a row exceeds the btree tuple limit.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block; apply this
+-- file with autocommit (e.g. psql -f).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS geo_echoes_pending_claim_idx
+    ON geo_echoes (created_at)
+    INCLUDE (echo_id, arweave_claimed_at)
+    WHERE is_permanent = TRUE AND arweave_tx_id IS NULL AND is_active = TRUE;
+
+-- priority_only path
+CREATE INDEX CONCURRENTLY IF NOT EXISTS geo_echoes_pending_claim_admin_idx
+    ON geo_echoes (created_at)
+    INCLUDE (echo_id, arweave_claimed_at)
+    WHERE is_permanent = TRUE AND arweave_tx_id IS NULL AND is_active = TRUE
+      AND echo_type = 'admin';
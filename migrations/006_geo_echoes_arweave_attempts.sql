@@ -0,0 +1,5 @@
+-- Number of times an uploader batch has claimed the echo (CLAIM_ECHOES_QUERY
+-- in main.py). Echoes the moderation agent still could not judge after
+-- MAX_ARWEAVE_ATTEMPTS claims are flagged instead of released again.
+ALTER TABLE geo_echoes
+    ADD COLUMN IF NOT EXISTS arweave_attempts integer NOT NULL DEFAULT 0;